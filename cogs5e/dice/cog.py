@@ -1,3 +1,5 @@
+import asyncio
+import functools
 import random
 
 import d20
@@ -15,8 +17,13 @@ from utils.argparser import argparse
 from utils.constants import SKILL_NAMES
 from utils.dice import PersistentRollContext, VerboseMDStringifier
 from utils.functions import search_and_select, try_delete, camel_to_title
-from .inline import InlineRoller
-from .utils import string_search_adv
+from .inline import INLINE_ROLLING_EMOJI, InlineRoller
+from .utils import ast_dice_count, parse_cached, roll_in_context, string_search_adv
+
+
+MAX_DICE_ON_EVENT_LOOP = 500
+# skill keys by their lowercase display name, so exact matches can skip the fuzzy search in search_and_select
+SKILL_KEYS_BY_NAME = {camel_to_title(skill).lower(): skill for skill in SKILL_NAMES}
 
 
 class Dice(commands.Cog):
@@ -31,6 +38,10 @@ class Dice(commands.Cog):
     async def quick_roll(self, ctx, *, mod: str = "0"):
         """Quickly rolls a d20."""
         dice = "1d20+" + mod
+        if mod.lstrip("+-").isdecimal():
+            # a plain modifier can't contain adv/dis or comments, so skip straight to rolling
+            res = d20.roll(parse_cached(dice, True), stringifier=VerboseMDStringifier())
+            return await self._send_roll(ctx, res)
         await self.roll_cmd(ctx, dice=dice)
 
     @commands.command(name="roll", aliases=["r"])
@@ -95,10 +106,14 @@ class Dice(commands.Cog):
 
         dice, adv = string_search_adv(dice)
 
-        res = d20.roll(dice, advantage=adv, allow_comments=True, stringifier=VerboseMDStringifier())
-        out = f"{ctx.author.mention}  :game_die:\n{str(res)}"
+        res = d20.roll(parse_cached(dice, True), advantage=adv, stringifier=VerboseMDStringifier())
+        await self._send_roll(ctx, res)
+
+    async def _send_roll(self, ctx, res):
+        res_str = str(res)
+        out = f"{ctx.author.mention}  :game_die:\n{res_str}"
         if len(out) > 1999:
-            out = f"{ctx.author.mention}  :game_die:\n{str(res)[:100]}...\n**Total**: {res.total}"
+            out = f"{ctx.author.mention}  :game_die:\n{res_str[:100]}...\n**Total**: {res.total}"
 
         await try_delete(ctx.message)
         await ctx.send(out, allowed_mentions=disnake.AllowedMentions(users=[ctx.author]))
@@ -126,34 +141,48 @@ class Dice(commands.Cog):
             return await ctx.send("Too many or too few iterations.")
         if adv is None:
             adv = d20.AdvType.NONE
-        results = []
-        successes = 0
-        ast = d20.parse(roll_str, allow_comments=True)
-        roller = d20.Roller(context=PersistentRollContext())
-
-        for _ in range(iterations):
-            res = roller.roll(ast, advantage=adv)
-            if dc is not None and res.total >= dc:
-                successes += 1
-            results.append(res)
+        ast = parse_cached(roll_str, True)
+        if adv != d20.AdvType.NONE:
+            # apply advantage to the AST once, rather than having the roller copy the tree on every iteration
+            ast = d20.utils.ast_adv_copy(ast, adv)
+        roll_context = PersistentRollContext()
+
+        if iterations * ast_dice_count(ast) > MAX_DICE_ON_EVENT_LOOP:
+            # large batches are rolled in a worker thread so they don't block the event loop
+            # the shared roller is only safe to use from the event loop, so the thread gets its own
+            roller = d20.Roller(context=roll_context)
+            results, successes, total = await asyncio.get_event_loop().run_in_executor(
+                None, _roll_iterations, roller.roll, ast, iterations, dc
+            )
+        else:
+            results, successes, total = _roll_iterations(
+                functools.partial(roll_in_context, context=roll_context), ast, iterations, dc
+            )
 
         if dc is None:
             header = f"Rolling {iterations} iterations..."
-            footer = f"{sum(o.total for o in results)} total."
+            footer = f"{total} total."
         else:
             header = f"Rolling {iterations} iterations, DC {dc}..."
-            footer = f"{successes} successes, {sum(o.total for o in results)} total."
+            footer = f"{successes} successes, {total} total."
 
         if ast.comment:
             header = f"{ast.comment}: {header}"
 
-        result_strs = "\n".join(str(o) for o in results)
-
-        out = f"{header}\n{result_strs}\n{footer}"
-
-        if len(out) > 1500:
-            one_result = str(results[0])
-            out = f"{header}\n{one_result}\n[{len(results) - 1} results omitted for output size.]\n{footer}"
+        # stringify results only until the output gets too long, at which point we just show the first one
+        result_strs = []
+        out_len = len(header) + len(footer) + 1  # newlines between header, results, and footer
+        for res in results:
+            res_str = str(res)
+            out_len += len(res_str) + 1
+            if out_len > 1500:
+                one_result = result_strs[0] if result_strs else res_str
+                out = f"{header}\n{one_result}\n[{len(results) - 1} results omitted for output size.]\n{footer}"
+                break
+            result_strs.append(res_str)
+        else:
+            result_strs = "\n".join(result_strs)
+            out = f"{header}\n{result_strs}\n{footer}"
 
         await try_delete(ctx.message)
         await ctx.send(f"{ctx.author.mention}\n{out}", allowed_mentions=disnake.AllowedMentions(users=[ctx.author]))
@@ -179,8 +208,7 @@ class Dice(commands.Cog):
         attacks = monster.attacks
 
         attack = await search_and_select(ctx, attacks, atk_name, lambda a: a.name)
-        args = await helpers.parse_snippets(args, ctx, statblock=monster, base_args=[monster_name, atk_name])
-        args = argparse(args)
+        args = await parse_monster_args(ctx, monster, args, base_args=[monster_name, atk_name])
 
         embed = embed_for_monster(monster, args)
 
@@ -209,9 +237,10 @@ class Dice(commands.Cog):
     async def monster_check(self, ctx, monster_name, check, *args):
         await try_delete(ctx.message)
         monster: Monster = await select_monster_full(ctx, monster_name)
-        args = await helpers.parse_snippets(args, ctx, statblock=monster, base_args=[monster_name, check])
-        args = argparse(args)
-        skill_key = await search_and_select(ctx, SKILL_NAMES, check, camel_to_title)
+        args = await parse_monster_args(ctx, monster, args, base_args=[monster_name, check])
+        skill_key = SKILL_KEYS_BY_NAME.get(check.strip("\"'").lower())
+        if skill_key is None:
+            skill_key = await search_and_select(ctx, SKILL_NAMES, check, camel_to_title)
 
         embed = embed_for_monster(monster, args)
 
@@ -232,8 +261,7 @@ class Dice(commands.Cog):
     async def monster_save(self, ctx, monster_name, save_stat, *args):
         await try_delete(ctx.message)
         monster: Monster = await select_monster_full(ctx, monster_name)
-        args = await helpers.parse_snippets(args, ctx, statblock=monster, base_args=[monster_name, save_stat])
-        args = argparse(args)
+        args = await parse_monster_args(ctx, monster, args, base_args=[monster_name, save_stat])
 
         embed = embed_for_monster(monster, args)
 
@@ -257,12 +285,15 @@ class Dice(commands.Cog):
     async def monster_cast(self, ctx, monster_name, spell_name, *args):
         await try_delete(ctx.message)
         monster: Monster = await select_monster_full(ctx, monster_name)
-        args = await helpers.parse_snippets(args, ctx, statblock=monster, base_args=[monster_name, spell_name])
-        args = argparse(args)
+        args = await parse_monster_args(ctx, monster, args, base_args=[monster_name, spell_name])
 
         if not args.last("i", type_=bool):
             try:
-                spell = await select_spell_full(ctx, spell_name, list_filter=lambda s: s.name in monster.spellbook)
+                # Spellbook.__contains__ scans every spell, so build a set once rather than scanning per candidate
+                spellbook_names = {s.name.lower() for s in monster.spellbook.spells}
+                spell = await select_spell_full(
+                    ctx, spell_name, list_filter=lambda s: s.name.lower() in spellbook_names
+                )
             except NoSelectionElements:
                 return await ctx.send(
                     "No matching spells found in the creature's spellbook. Cast again "
@@ -282,21 +313,53 @@ class Dice(commands.Cog):
     # ==== inline rolling ====
     @commands.Cog.listener()
     async def on_message(self, message):
-        if message.author.bot:
+        # cheap checks first - this runs on every message, so avoid creating the handler coroutine where possible
+        if message.author.bot or "[[" not in message.content:
             return
         await self.inline.handle_message_inline_rolls(message)
 
     @commands.Cog.listener()
     async def on_reaction_add(self, reaction, user):
-        if user.bot:
+        if (
+            user.bot
+            or reaction.emoji != INLINE_ROLLING_EMOJI
+            or user.id != reaction.message.author.id
+            or "[[" not in reaction.message.content
+        ):
             return
         await self.inline.handle_reaction_inline_rolls(reaction, user)
 
 
+def _roll_iterations(roll, ast, iterations, dc=None):
+    """
+    Rolls an AST a number of times with the given roll function.
+
+    :returns: A tuple (results, successes, total), where successes is the number of results meeting the DC (if given)
+              and total is the sum of all the results' totals.
+    """
+    results = []
+    successes = 0
+    total = 0
+    for _ in range(iterations):
+        res = roll(ast)
+        res_total = res.total
+        total += res_total
+        if dc is not None and res_total >= dc:
+            successes += 1
+        results.append(res)
+    return results, successes, total
+
+
+async def parse_monster_args(ctx, monster, args, base_args):
+    """Parses snippets in a monster command's arguments in the context of the monster, and returns the parsed args."""
+    args = await helpers.parse_snippets(args, ctx, statblock=monster, base_args=base_args)
+    return argparse(args)
+
+
 def embed_for_monster(monster, args, embed=None):
     if not embed:
         embed = disnake.Embed()
-    embed.colour = random.randint(0, 0xFFFFFF)
+    embed.colour = random.getrandbits(24)  # same distribution as randint(0, 0xFFFFFF), minus the range handling
     if not args.last("h", type_=bool) and "thumb" not in args:
         embed.set_thumbnail(url=monster.get_image_url())
     return embed
@@ -10,19 +10,27 @@ from cogs5e.models.errors import AvraeException, InvalidArgument, NoCharacter
 from utils import constants
 from utils.dice import PersistentRollContext
 from utils.functions import camel_to_title, verbose_stat
-from .utils import string_search_adv
+from .utils import parse_cached, roll_in_context, string_search_adv
 
 INLINE_ROLLING_EMOJI = "\U0001f3b2"  # :game_die:
-INLINE_ROLLING_RE = re.compile(r"\[\[(.+?]?)]]")
+# expressions are capped at 200 characters and may not contain another "[[", so pathological input is rejected by the
+# regex engine in a bounded scan rather than being handed to d20
+INLINE_ROLLING_RE = re.compile(r"\[\[((?:(?!\[\[).){1,200}?]?)]]")
+NEWLINES_TO_SPACES = str.maketrans("\r\n", "  ")
+MAX_ONBOARDED_CACHE_SIZE = 100_000
 _sentinel = object()
 
 
 class InlineRoller:
     def __init__(self, bot):
         self.bot = bot
+        # ids of users we know have been onboarded, so we don't need to ask redis again
+        self._onboarded_message_users: set[int] = set()
+        self._onboarded_reaction_users: set[int] = set()
 
     # ==== entrypoints ====
     async def handle_message_inline_rolls(self, message):
+        """Rolls a message's inline rolls. The caller should already have skipped bots and messages without ``[[``."""
         # find roll expressions
         if not INLINE_ROLLING_RE.search(message.content):
             return
@@ -56,10 +64,10 @@ class InlineRoller:
         await self.do_inline_rolls(message)
 
     async def handle_reaction_inline_rolls(self, reaction, user):
-        if user.id != reaction.message.author.id:
-            return
-        if reaction.emoji != INLINE_ROLLING_EMOJI:
-            return
+        """
+        Rolls a message's inline rolls when its author reacts to it.
+        The caller should already have checked the emoji, the reacting user, and that the message contains ``[[``.
+        """
         message = reaction.message
 
         # find roll expressions
@@ -81,14 +89,13 @@ class InlineRoller:
         if guild_settings.inline_enabled is not utils.settings.guild.InlineRollingType.REACTION:
             return
 
-        # if this message has already been processed, skip
-        if await self.bot.rdb.get(f"cog.dice.inline_rolling.messages.{message.id}.processed"):
+        # save that this message has been processed - if it already was, skip
+        if not await self.bot.rdb.set(
+            f"cog.dice.inline_rolling.messages.{message.id}.processed", str(time.time()), ex=60 * 60 * 24, nx=True
+        ):
             return
 
-        # otherwise save that this message has been processed, remove reactions, and do the rolls
-        await self.bot.rdb.setex(
-            f"cog.dice.inline_rolling.messages.{message.id}.processed", str(time.time()), 60 * 60 * 24
-        )
+        # otherwise remove reactions and do the rolls
         await self.do_inline_rolls(message)
         try:
             await reaction.clear()
@@ -97,38 +104,46 @@ class InlineRoller:
 
     # ==== execution ====
     async def do_inline_rolls(self, message):
-        roll_exprs = _find_inline_exprs(message.content)
+        roll_exprs = list(_find_inline_exprs(message.content))
 
-        out = []
-        roller = d20.Roller(context=PersistentRollContext())
+        # one slot per expression; expressions that aren't valid rolls leave their slot empty
+        out = [None] * len(roll_exprs)
+        roll_context = PersistentRollContext()
         char_replacer = CharacterReplacer(self.bot, message)
-        for expr, context_before, context_after in roll_exprs:
-            context_before = context_before.replace("\n", " ")
-            context_after = context_after.replace("\n", " ")
+        for idx, (expr, context_before, context_after) in enumerate(roll_exprs):
+            context_before = context_before.translate(NEWLINES_TO_SPACES)
+            context_after = context_after.translate(NEWLINES_TO_SPACES)
 
             try:
                 expr, char_comment = await char_replacer.replace(expr)
                 expr, adv = string_search_adv(expr)
-                result = roller.roll(expr, advantage=adv, allow_comments=True)
+                result = roll_in_context(parse_cached(expr, True), roll_context, advantage=adv)
                 if result.comment:
-                    out.append(f"**{result.comment.strip()}**: {result.result}")
+                    out[idx] = f"**{result.comment.strip()}**: {result.result}"
                 elif char_comment:
-                    out.append(f"{context_before}({char_comment}: {result.result}){context_after}")
+                    out[idx] = f"{context_before}({char_comment}: {result.result}){context_after}"
                 else:
-                    out.append(f"{context_before}({result.result}){context_after}")
+                    out[idx] = f"{context_before}({result.result}){context_after}"
             except d20.RollSyntaxError:
                 continue
             except (d20.RollError, AvraeException) as e:
-                out.append(f"{context_before}({e!s}){context_after}")
+                out[idx] = f"{context_before}({e!s}){context_after}"
 
-        if not out:
+        reply = "\n".join(line for line in out if line is not None)
+        if not reply:
             return
 
-        await message.reply("\n".join(out))
+        await message.reply(reply)
 
     # ==== onboarding ====
     async def inline_rolling_message_onboarding(self, user):
-        if await self.bot.rdb.get(f"cog.dice.inline_rolling.users.{user.id}.onboarded.message"):
+        if user.id in self._onboarded_message_users:
+            return
+
+        # claim the onboarding in one round trip; if the key was already set, the user has been onboarded
+        onboarded_key = f"cog.dice.inline_rolling.users.{user.id}.onboarded.message"
+        if not await self.bot.rdb.set(onboarded_key, str(time.time()), nx=True):
+            _add_bounded(self._onboarded_message_users, user.id)
             return
 
         embed = embeds.EmbedWithColor()
@@ -158,11 +173,19 @@ class InlineRoller:
         try:
             await user.send(embed=embed)
         except disnake.HTTPException:
+            # we couldn't onboard them, so try again next time
+            await self.bot.rdb.delete(onboarded_key)
             return
-        await self.bot.rdb.set(f"cog.dice.inline_rolling.users.{user.id}.onboarded.message", str(time.time()))
+        _add_bounded(self._onboarded_message_users, user.id)
 
     async def inline_rolling_reaction_onboarding(self, user):
-        if await self.bot.rdb.get(f"cog.dice.inline_rolling.users.{user.id}.onboarded.reaction"):
+        if user.id in self._onboarded_reaction_users:
+            return
+
+        # claim the onboarding in one round trip; if the key was already set, the user has been onboarded
+        onboarded_key = f"cog.dice.inline_rolling.users.{user.id}.onboarded.reaction"
+        if not await self.bot.rdb.set(onboarded_key, str(time.time()), nx=True):
+            _add_bounded(self._onboarded_reaction_users, user.id)
             return
 
         embed = embeds.EmbedWithColor()
@@ -191,8 +214,10 @@ class InlineRoller:
         try:
             await user.send(embed=embed)
         except disnake.HTTPException:
+            # we couldn't onboard them, so try again next time
+            await self.bot.rdb.delete(onboarded_key)
             return
-        await self.bot.rdb.set(f"cog.dice.inline_rolling.users.{user.id}.onboarded.reaction", str(time.time()))
+        _add_bounded(self._onboarded_reaction_users, user.id)
 
 
 # ==== character-aware rolls ====
@@ -247,68 +272,76 @@ class CharacterReplacer:
 
 
 # ==== helpers ====
+def _add_bounded(cache, item, max_size=MAX_ONBOARDED_CACHE_SIZE):
+    """Adds an item to a set used as a cache, clearing it first if it has grown too large."""
+    if len(cache) >= max_size:
+        cache.clear()
+    cache.add(item)
+
+
 def _find_inline_exprs(content, context_before=5, context_after=2, max_context_len=128):
     """Returns an iterator of tuples (expr, context_before, context_after)."""
 
     # create list alternating (before, expr; text, expr; ...; text, expr; after)
     segments = INLINE_ROLLING_RE.split(content)
 
-    # want (before, expr, after; ...; before, expr, after)
-    # so split up each pair of (text, expr) by trimming the text into (last_after, before, expr)
-    # with priority on before
-    trimmed_segments = []
+    # each text is trimmed into (last_after, before), with priority on before
+    # since neither can be longer than max_context_len, we only ever split that much of the text into words
+    # the last expression's after is only known once we reach the next text, so it is yielded one step behind
+    pending = None  # (expr, context_before) of the last expression seen
     for text, expr in zip(a := iter(segments), a):  # fun way to take pairs from a list!
         text_len = len(text)
 
         # before is always text[before_idx:len(text)]
+        before_window_idx = max(text_len - max_context_len - 1, 0)
         before_idx = 0
-        before_bits = text.rsplit(maxsplit=context_before)
+        before_bits = text[before_window_idx:].rsplit(maxsplit=context_before)
         if len(before_bits) > context_before:
-            before_idx += len(before_bits[0])
+            before_idx = before_window_idx + len(before_bits[0])
         before_idx = max(before_idx, text_len - max_context_len)
         before = text[before_idx:text_len]
 
         # last_after is always text[0:last_after_end_idx]
         last_after_end_idx = text_len
-        after_bits = text.split(maxsplit=context_after)
+        after_window = text[: max_context_len + 1]
+        after_bits = after_window.split(maxsplit=context_after)
         if len(after_bits) > context_after:
-            last_after_end_idx -= len(after_bits[-1])
+            last_after_end_idx = len(after_window) - len(after_bits[-1])
         last_after_end_idx = min(last_after_end_idx, before_idx, max_context_len)
         last_after = text[0:last_after_end_idx]
 
-        trimmed_segments.extend((last_after, before, expr))
+        if pending is None:
+            # the first text has no expression before it, but we use whether anything was chopped off for ellipses
+            discarded_before = bool(last_after)
+        else:
+            last_expr, last_context_before = pending
+            yield last_expr, last_context_before, f"{last_after.rstrip()}..."
+            discarded_before = True
 
-    if not trimmed_segments:
+        expr_context_before = before.lstrip()
+        if discarded_before:
+            expr_context_before = f"...{expr_context_before}"
+        pending = (expr.strip(), expr_context_before)
+
+    if pending is None:
         return
 
-    # now we have (junk, before, expr; after, before, expr; ...; after, before, expr)
-    # discard the first junk
-    discarded_before = trimmed_segments.pop(0)
-    # and clean up the last after
+    # clean up the last after
     discarded_after = False
     last_after = segments[-1]
     last_after_end_idx = len(last_after)
-    after_bits = last_after.split(maxsplit=context_after)
+    after_window = last_after[: max_context_len + 1]
+    after_bits = after_window.split(maxsplit=context_after)
     if len(after_bits) > context_after:
-        last_after_end_idx -= len(after_bits[-1])
+        last_after_end_idx = len(after_window) - len(after_bits[-1])
         discarded_after = True
     if last_after_end_idx > max_context_len:
         last_after_end_idx = max_context_len
         discarded_after = True
-    trimmed_segments.append(last_after[0:last_after_end_idx])
-    # we also use whether or not the chopped-off bits at the very start and end exist for ellipses
-
-    # now we have (before, expr, after; ...)
-    # do ellipses and yield triples (expr, context_before, context_after)
-    num_triples = len(trimmed_segments) // 3
-    for idx, (before, expr, after) in enumerate(zip(a := iter(trimmed_segments), a, a)):
-        context_before = before.lstrip()
-        context_after = after.rstrip()
-
-        if idx or discarded_before:  # not the first or something was discarded before first
-            context_before = f"...{context_before}"
 
-        if idx + 1 < num_triples or discarded_after:  # not the last or something was discarded after last
-            context_after = f"{context_after}..."
+    expr_context_after = last_after[0:last_after_end_idx].rstrip()
+    if discarded_after:
+        expr_context_after = f"{expr_context_after}..."
 
-        yield expr.strip(), context_before, context_after
+    last_expr, last_context_before = pending
+    yield last_expr, last_context_before, expr_context_after
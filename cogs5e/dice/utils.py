@@ -1,3 +1,4 @@
+import functools
 import re
 
 import d20
@@ -15,7 +16,44 @@ def string_search_adv(dice_str: str):
     ("1d20", d20.AdvType.NONE)
     """
     adv = d20.AdvType.NONE
+    # most rolls have neither word, so skip the regex scan entirely in that case
+    if "adv" not in dice_str and "dis" not in dice_str:
+        return dice_str, adv
     if (match := ADV_WORD_RE.search(dice_str)) is not None:
         adv = d20.AdvType.ADV if match.group(1) == "adv" else d20.AdvType.DIS
         return dice_str[: match.start(1)] + dice_str[match.end() :], adv
     return dice_str, adv
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_cached(dice_str: str, allow_comments: bool = True) -> d20.ast.Expression:
+    """
+    Parses a dice string into a d20 AST, caching the result for repeated expressions.
+
+    The returned AST is shared between callers and must not be mutated; ``d20.Roller.roll`` evaluates it into a new
+    expression tree (and copies it when rolling with advantage), so it is safe to roll the same AST many times.
+
+    :raises d20.RollSyntaxError: if the dice string cannot be parsed.
+    """
+    return d20.parse(dice_str, allow_comments=allow_comments)
+
+
+_shared_roller = d20.Roller()
+
+
+def roll_in_context(expr, context: d20.RollContext, **kwargs) -> d20.RollResult:
+    """
+    Rolls a dice expression or AST with a roller shared by the dice cog, using the given roll context.
+
+    Binding the context and rolling happen without yielding to the event loop, so concurrent callers can share the
+    roller while each keeps its own context (e.g. a PersistentRollContext tracking the rolls of one batch).
+    """
+    _shared_roller.context = context
+    return _shared_roller.roll(expr, **kwargs)
+
+
+def ast_dice_count(node: d20.ast.Node) -> int:
+    """Returns the number of dice a d20 AST rolls, not counting any rerolled or exploded dice."""
+    if isinstance(node, d20.ast.Dice):
+        return node.num
+    return sum(ast_dice_count(child) for child in node.children)
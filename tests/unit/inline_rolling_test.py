@@ -0,0 +1,30 @@
+from cogs5e.dice.inline import _find_inline_exprs
+
+
+def test_find_inline_exprs():
+    assert list(_find_inline_exprs("no rolls here")) == []
+    assert list(_find_inline_exprs("[[1d20]]")) == [("1d20", "", "")]
+    assert list(_find_inline_exprs("one two [[1d20]] three four five")) == [("1d20", "one two ", " three four...")]
+    assert list(_find_inline_exprs("[[1d20]][[1d6]]")) == [("1d20", "", "..."), ("1d6", "...", "")]
+    assert list(_find_inline_exprs("line one\nline two [[1d20]]")) == [("1d20", "line one\nline two ", "")]
+
+
+def test_find_inline_exprs_context():
+    # context before has priority over the previous expression's context after
+    assert list(
+        _find_inline_exprs(
+            "I attack the goblin with my shortsword [[1d20 + 6]] for a total of [[1d6 + 3]] piercing damage."
+        )
+    ) == [
+        ("1d20 + 6", "...the goblin with my shortsword ", "..."),
+        ("1d6 + 3", "...for a total of ", " piercing damage."),
+    ]
+    assert list(_find_inline_exprs("a " * 100 + "[[1d4]]")) == [("1d4", "...a a a a a ", "")]
+    # context is limited by length as well as words
+    assert list(_find_inline_exprs("[[1d4]] " + "a" * 200)) == [("1d4", "", " " + "a" * 127 + "...")]
+
+
+def test_find_inline_exprs_limits():
+    assert list(_find_inline_exprs("[[1d20[fire]]]")) == [("1d20[fire]", "", "")]
+    assert list(_find_inline_exprs("[[" + "1" * 201 + "]]")) == []
+    assert list(_find_inline_exprs("[[ [[1d20]] ]]")) == [("1d20", "[[ ", " ]]")]